@@ -9,43 +9,189 @@ This script checks that:
 5. Index.json is consistent with package files
 """
 
+import hashlib
+import io
 import json
 import os
+import socket
+import subprocess
 import sys
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from functools import lru_cache
+from itertools import zip_longest
 from pathlib import Path
+from threading import BoundedSemaphore
+from urllib.parse import urlparse
+from urllib.request import getproxies
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib parser
+    _loads = json.loads
 
 # Constants
 PACKAGES_DIR = "packages"
 INDEX_FILE = "index.json"
+CACHE_FILE = ".validation-cache.json"
+REPORT_FILE = "validation-report.json"
+CACHE_TTL = 7 * 24 * 60 * 60  # seconds a passing package file is trusted for
 TIMEOUT = 10  # seconds
+MAX_WORKERS = 32  # concurrent download URL checks
+MAX_PER_HOST = 8  # concurrent download URL checks against a single host
+RETRIES = 2  # retries for host probes and HTTP checks
+BACKOFF_FACTOR = 0.2  # seconds, doubled on each retry
+LOAD_WORKERS = 8  # concurrent package file reads
+HEAD_REFUSED_STATUSES = {403, 405, 501}  # retried as a one-byte ranged GET
+
+# Required top-level package fields, with their expected type
+REQUIRED_FIELDS = {
+    "name": (str, "a string"),
+    "author": (str, "a string"),
+    "description": (str, "a string"),
+    "versions": (dict, "an object"),
+}
+
+
+def create_session():
+    """Create an HTTP session that keeps connections alive across URL checks."""
+    session = requests.Session()
+    # Liveness checks never read a body, so keep request headers minimal
+    session.headers.update({
+        "User-Agent": "rainmeas-validate/1",
+        "Accept-Encoding": "identity",
+        "Accept": "*/*",
+    })
+    retries = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    )
+    # Keep a pooled connection for every request allowed in flight to a host
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_PER_HOST, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Shared by all worker threads so connections to the same host are reused
+SESSION = create_session()
+
+# Host probes connect directly, so they are skipped when a proxy is configured
+DIRECT_CONNECT = not getproxies()
+
+
+def read_json_file(filepath):
+    """Load and parse a JSON file without printing.
+    
+    Returns (data, file_hash, error), where file_hash is the SHA-256 hex digest
+    of the raw file contents, or None if the file couldn't be read.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None, None, f"File not found: {filepath}"
+    except Exception as e:
+        return None, None, f"Failed to read {filepath}: {e}"
+    
+    file_hash = hashlib.sha256(raw).hexdigest()
+    try:
+        return _loads(raw), file_hash, None
+    except ValueError as e:  # JSONDecodeError (stdlib and orjson) and UnicodeDecodeError
+        return None, file_hash, f"Invalid JSON in {filepath}: {e}"
 
 
 def load_json_file(filepath):
     """Load and parse a JSON file."""
+    data, _, error = read_json_file(filepath)
+    if error:
+        print(f"❌ Error: {error}")
+    return data
+
+
+def load_validation_cache():
+    """Load the cache of package file hashes, dropping expired entries."""
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    cache, _, error = read_json_file(CACHE_FILE)
+    if error or not isinstance(cache, dict):
+        print(f"⚠️ Ignoring unusable {CACHE_FILE}: {error or 'not an object'}")
+        return {}
+    cutoff = time.time() - CACHE_TTL
+    return {
+        file_hash: entry for file_hash, entry in cache.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get("timestamp"), (int, float))
+        and entry["timestamp"] > cutoff
+    }
+
+
+def save_validation_cache(cache):
+    """Write the cache of package file hashes."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError as e:
-        print(f"❌ Error: Invalid JSON in {filepath}: {e}")
-        return None
-    except FileNotFoundError:
-        print(f"❌ Error: File not found: {filepath}")
+        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        print(f"⚠️ Failed to write {CACHE_FILE}: {e}")
+
+
+def run_git(*args):
+    """Run a git command and return its stdout."""
+    result = subprocess.run(["git", *args], capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def changed_package_names(index_data):
+    """Return the packages changed in a pull request, or None to validate everything."""
+    base_ref = os.environ.get("GITHUB_BASE_REF")
+    if not base_ref:
         return None
-    except Exception as e:
-        print(f"❌ Error: Failed to read {filepath}: {e}")
+    
+    try:
+        merge_base = run_git("merge-base", f"origin/{base_ref}", "HEAD").strip()
+        changed_files = run_git(
+            "diff", "--name-only", "--diff-filter=AM", merge_base, "HEAD", "--", PACKAGES_DIR, INDEX_FILE
+        ).splitlines()
+        base_index = _loads(run_git("show", f"{merge_base}:{INDEX_FILE}")) if INDEX_FILE in changed_files else {}
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        print(f"⚠️ Could not determine changed packages, validating all: {e}")
         return None
+    
+    names = {
+        os.path.basename(path)[:-5] for path in changed_files
+        if path.startswith(f"{PACKAGES_DIR}/") and path.endswith(".json")
+    }
+    
+    # Packages whose index.json entry changed are validated too
+    if INDEX_FILE in changed_files and isinstance(base_index, dict):
+        names.update(
+            package_name for package_name, entry in index_data.items()
+            if base_index.get(package_name) != entry
+        )
+    
+    return names
 
 
 def validate_package_structure(package_name, package_data):
     """Validate the structure of a package definition."""
-    required_fields = ["name", "author", "description", "versions"]
+    if not isinstance(package_data, dict):
+        return ["Package definition must be an object"]
+    
     errors = []
     
-    # Check required top-level fields
-    for field in required_fields:
+    # Check required top-level fields and their types
+    for field, (field_type, type_name) in REQUIRED_FIELDS.items():
         if field not in package_data:
             errors.append(f"Missing required field: {field}")
+        elif not isinstance(package_data[field], field_type):
+            errors.append(f"Field '{field}' must be {type_name}")
     
     # Check that name matches filename
     if package_data.get("name") != package_name:
@@ -56,103 +202,303 @@ def validate_package_structure(package_name, package_data):
         errors.append(f"Package name '{package_name}' contains spaces. Package names must not contain spaces.")
     
     # Check versions structure
-    if "versions" in package_data:
-        versions = package_data["versions"]
-        if not isinstance(versions, dict):
-            errors.append("Versions must be an object")
-        else:
-            # Check that latest version exists
-            if "latest" in versions:
-                latest = versions["latest"]
-                if latest not in versions:
-                    errors.append(f"Latest version '{latest}' not found in versions")
-            else:
-                errors.append("Missing 'latest' field in versions")
+    versions = package_data.get("versions")
+    if isinstance(versions, dict):
+        # Check that latest version exists
+        if "latest" not in versions:
+            errors.append("Missing 'latest' field in versions")
+        elif not isinstance(versions["latest"], str):
+            errors.append("Field 'latest' in versions must be a string")
+        elif versions["latest"] not in versions:
+            errors.append(f"Latest version '{versions['latest']}' not found in versions")
     
     return errors
 
 
-def validate_version_download_url(version, download_url):
-    """Validate that a download URL is accessible."""
+def url_address(download_url):
+    """Return the (host, port) a URL connects to, or None if it has no usable host."""
+    try:
+        parsed = urlparse(download_url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return None
+    if not parsed.hostname:
+        return None
+    return parsed.hostname, port
+
+
+@lru_cache(maxsize=None)
+def probe_host(host, port):
+    """Open a TCP connection to (host, port), returning the error if every attempt fails."""
+    for attempt in range(RETRIES + 1):
+        try:
+            socket.create_connection((host, port), timeout=TIMEOUT).close()
+            return None
+        except OSError as e:
+            error = e
+        if attempt < RETRIES:
+            # Back off like the session's Retry so a transient blip isn't fatal
+            time.sleep(BACKOFF_FACTOR * 2 ** attempt)
+    return error
+
+
+@lru_cache(maxsize=None)
+def check_url(download_url):
+    """Check that a URL is accessible, caching the result per URL."""
+    # Skip HTTP entirely when the host doesn't accept connections
+    address = url_address(download_url)
+    if DIRECT_CONNECT and address is not None:
+        error = probe_host(*address)
+        if error is not None:
+            return False, f"Could not connect to host '{address[0]}' ({error})"
+    
     try:
         # Make a HEAD request to check if URL is accessible
-        response = requests.head(download_url, timeout=TIMEOUT, allow_redirects=True)
-        if response.status_code == 200:
+        response = SESSION.head(download_url, stream=True, timeout=TIMEOUT, allow_redirects=True)
+        response.close()
+        if response.status_code in HEAD_REFUSED_STATUSES:
+            # Some hosts refuse HEAD; fetch a single byte instead
+            response = SESSION.get(
+                download_url,
+                headers={"Range": "bytes=0-0"},
+                stream=True,
+                timeout=TIMEOUT,
+                allow_redirects=True,
+            )
+            response.close()
+        if response.status_code in (200, 206):
             return True, ""
         elif response.status_code == 404:
-            return False, f"URL not found (404) for version {version}"
+            return False, "URL not found (404)"
         else:
-            return False, f"HTTP {response.status_code} for version {version}"
+            return False, f"HTTP {response.status_code}"
     except requests.exceptions.Timeout:
-        return False, f"Timeout when checking download URL for version {version}"
+        return False, "Timeout when checking download URL"
     except requests.exceptions.RequestException as e:
-        return False, f"Error checking download URL for version {version}: {e}"
+        return False, f"Error checking download URL ({e})"
+
+
+def validate_version_download_url(version, download_url):
+    """Validate that a download URL is accessible."""
+    is_valid, reason = check_url(download_url)
+    if is_valid:
+        return True, ""
+    return False, f"{reason} for version {version}"
+
+
+def collect_download_urls(package_name, package_data):
+    """Collect the (package, version, url) triples that need a URL check."""
+    downloads = []
+    versions = package_data.get("versions", {})
+    
+    for version, version_data in versions.items():
+        # Skip the structural fields
+        if version == "latest":
+            continue
+        download_url = version_data.get("download") if isinstance(version_data, dict) else None
+        if isinstance(download_url, str) and download_url:
+            downloads.append((package_name, version, download_url))
+    
+    return downloads
 
 
-def validate_package_versions(package_name, package_data):
-    """Validate all versions of a package."""
+def probe_hosts(addresses):
+    """Probe each (host, port) once, concurrently, filling the probe_host cache."""
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(lambda address: probe_host(*address), addresses))
+
+
+def interleave_by_host(urls):
+    """Group URLs by host and order them round-robin across hosts."""
+    by_host = {}
+    for download_url in urls:
+        by_host.setdefault(url_address(download_url), []).append(download_url)
+    return [
+        download_url
+        for group in zip_longest(*by_host.values())
+        for download_url in group
+        if download_url is not None
+    ]
+
+
+def check_download_urls(downloads):
+    """Check download URLs concurrently, keyed by (package, version)."""
+    # Versions sharing an artifact are checked once
+    urls = list(dict.fromkeys(download_url for _, _, download_url in downloads))
+    
+    # Probe every host once up front so unreachable ones fail without HTTP
+    if DIRECT_CONNECT:
+        addresses = {url_address(download_url) for download_url in urls}
+        addresses.discard(None)
+        probe_hosts(sorted(addresses))
+    
+    # Bound in-flight requests per host so one host isn't hit by every worker
+    host_limits = {
+        address: BoundedSemaphore(MAX_PER_HOST)
+        for address in map(url_address, urls)
+        if address is not None
+    }
+    
+    def check(download_url):
+        address = url_address(download_url)
+        if address is None:
+            # No usable host: check_url reports the URL as invalid without a connection
+            check_url(download_url)
+            return
+        with host_limits[address]:
+            check_url(download_url)
+    
+    # Spread hosts across the pool so workers don't queue on one host's limit
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(check, interleave_by_host(urls)))
+    
+    # Every URL is now in the check_url cache
+    return {
+        (package_name, version): validate_version_download_url(version, download_url)
+        for package_name, version, download_url in downloads
+    }
+
+
+def validate_package_versions(package_name, package_data, url_results):
+    """Validate all versions of a package against the checked download URLs.
+    
+    Errors and warnings are returned as (version, message) pairs.
+    """
     errors = []
     warnings = []
     
     if "versions" not in package_data:
-        errors.append("Missing versions data")
+        errors.append((None, "Missing versions data"))
         return errors, warnings
     
     versions = package_data["versions"]
     
-    # Skip the structural fields
-    version_keys = [k for k in versions.keys() if k not in ["latest"]]
-    
-    for version in version_keys:
-        version_data = versions[version]
+    for version, version_data in versions.items():
+        # Skip the structural fields
+        if version == "latest":
+            continue
         
         # For version entries that are objects
         if isinstance(version_data, dict):
-            if "download" not in version_data:
-                errors.append(f"Version {version} missing download URL")
+            download_url = version_data.get("download")
+            if download_url is None:
+                errors.append((version, f"Version {version} missing download URL"))
+                continue
+            if not isinstance(download_url, str) or not download_url:
+                errors.append((version, f"Version {version} download URL must be a non-empty string"))
                 continue
             
-            download_url = version_data["download"]
-            
-            # Validate download URL
-            is_valid, message = validate_version_download_url(version, download_url)
+            # Look up the result of the download URL check
+            result = url_results.get((package_name, version))
+            if result is None:
+                # URL checks were skipped for this package
+                continue
+            is_valid, message = result
             if not is_valid:
-                errors.append(f"Invalid download URL for {package_name}@{version}: {message}")
+                errors.append((version, f"Invalid download URL for {package_name}@{version}: {message}"))
             else:
                 print(f"✅ Valid download URL for {package_name}@{version}")
         else:
-            warnings.append(f"Version {version} is not an object (might be legacy format)")
+            warnings.append((version, f"Version {version} is not an object (might be legacy format)"))
     
     return errors, warnings
 
 
-def validate_index_consistency(index_data, package_files):
-    """Validate that index.json is consistent with package files."""
+def validate_index_consistency(index_keys, package_files):
+    """Validate that the package names in index.json are consistent with package files."""
     errors = []
+    file_stems = {f[:-5] for f in package_files}
     
     # Check that all packages in index.json have corresponding files
-    for package_name in index_data.keys():
-        expected_file = f"{package_name}.json"
-        if expected_file not in package_files:
-            errors.append(f"Package '{package_name}' in index.json but no corresponding file in packages/")
+    for package_name in sorted(index_keys - file_stems):
+        errors.append(f"Package '{package_name}' in index.json but no corresponding file in packages/")
     
     # Check that all package files are referenced in index.json
-    package_names_in_index = set(index_data.keys())
-    for package_file in package_files:
-        package_name = package_file.replace(".json", "")
-        if package_name not in package_names_in_index:
-            errors.append(f"Package file '{package_file}' not referenced in index.json")
+    for package_name in sorted(file_stems - index_keys):
+        errors.append(f"Package file '{package_name}.json' not referenced in index.json")
     
     return errors
 
 
+def make_issue(package_name, version, kind, message):
+    """Build a structured report entry."""
+    return {"package": package_name, "version": version, "kind": kind, "message": message}
+
+
+def report_package(package_name, package_data, structure_errors, url_results, cached=False):
+    """Print the validation results for one package and return its errors and warnings."""
+    print(f"📦 Validating package: {package_name}")
+    if cached:
+        print("⏭️ Package file unchanged since its last successful validation, skipping download URL checks")
+    
+    if package_data is None:
+        # Load failures carry the loader's error in place of structure errors
+        for error in structure_errors:
+            print(f"❌ Error: {error}")
+        print()
+        return [make_issue(package_name, None, "load", error) for error in structure_errors], []
+    
+    for error in structure_errors:
+        print(f"❌ {error}")
+    
+    if structure_errors:
+        print()
+        return [make_issue(package_name, None, "structure", error) for error in structure_errors], []
+    
+    # Validate package versions
+    version_errors, version_warnings = validate_package_versions(package_name, package_data, url_results)
+    for _, error in version_errors:
+        print(f"❌ {error}")
+    for _, warning in version_warnings:
+        print(f"⚠️ {warning}")
+    
+    if not version_errors and not version_warnings:
+        print(f"✅ Package {package_name} is valid")
+    
+    print()
+    return (
+        [make_issue(package_name, version, "version", error) for version, error in version_errors],
+        [make_issue(package_name, version, "version", warning) for version, warning in version_warnings],
+    )
+
+
+def escape_annotation(message):
+    """Escape a message for a GitHub Actions workflow command."""
+    return message.replace("%", "%25").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def write_report(errors, warnings):
+    """Write the JSON report and, on GitHub Actions, emit annotations in one write."""
+    try:
+        with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"errors": errors, "warnings": warnings}, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ Failed to write {REPORT_FILE}: {e}")
+    
+    if os.environ.get("GITHUB_ACTIONS") != "true":
+        return
+    
+    lines = []
+    for level, issues in (("error", errors), ("warning", warnings)):
+        for issue in issues:
+            if issue["package"] is None:
+                filename = INDEX_FILE
+            else:
+                filename = f"{PACKAGES_DIR}/{issue['package']}.json"
+            lines.append(f"::{level} file={filename}::{escape_annotation(issue['message'])}\n")
+    sys.stdout.write("".join(lines))
+
+
 def main():
     """Main validation function."""
+    # Let stdout coalesce writes instead of flushing on every line
+    sys.stdout.reconfigure(line_buffering=False)
+    
     print("🔍 Validating rainmeas package registry...\n")
     
     # Track overall status
-    total_errors = 0
-    total_warnings = 0
+    all_errors = []
+    all_warnings = []
     
     # Load index.json
     print("📄 Checking index.json...")
@@ -162,6 +508,7 @@ def main():
         print("❌ Failed to load index.json")
         return 1
     
+    index_keys = frozenset(index_data)
     print("✅ Loaded index.json successfully\n")
     
     # Get list of package files
@@ -169,65 +516,79 @@ def main():
         print(f"❌ Packages directory '{PACKAGES_DIR}' not found")
         return 1
     
-    package_files = [f for f in os.listdir(PACKAGES_DIR) if f.endswith('.json')]
+    with os.scandir(PACKAGES_DIR) as it:
+        package_entries = [e for e in it if e.is_file() and e.name.endswith('.json')]
+    package_files = [entry.name for entry in package_entries]
     print(f"📁 Found {len(package_files)} package files\n")
     
     # Validate index.json consistency
     print("🔗 Checking index.json consistency...")
-    consistency_errors = validate_index_consistency(index_data, package_files)
+    consistency_errors = validate_index_consistency(index_keys, package_files)
     for error in consistency_errors:
         print(f"❌ {error}")
-        total_errors += 1
+        all_errors.append(make_issue(None, None, "consistency", error))
     
     if not consistency_errors:
         print("✅ Index.json is consistent with package files")
     print()
     
-    # Validate each package
-    for package_file in package_files:
-        package_name = package_file.replace(".json", "")
-        print(f"📦 Validating package: {package_name}")
+    # On pull requests, only validate the packages that changed
+    changed = changed_package_names(index_data)
+    if changed is not None:
+        package_entries = [entry for entry in package_entries if entry.name[:-5] in changed]
+        print(f"🔀 Pull request: validating {len(package_entries)} changed package files\n")
+    
+    # Load and hash all package files concurrently, then structurally validate each one
+    cache = load_validation_cache()
+    packages = []
+    downloads = []
+    package_paths = [entry.path for entry in package_entries]
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        loaded = list(executor.map(read_json_file, package_paths))
+    
+    for entry, (package_data, file_hash, load_error) in zip(package_entries, loaded):
+        package_name = entry.name[:-5]
         
-        # Load package file
-        package_path = os.path.join(PACKAGES_DIR, package_file)
-        package_data = load_json_file(package_path)
-        if package_data is None:
-            total_errors += 1
-            print()
+        if load_error:
+            packages.append((package_name, None, [load_error], file_hash, False))
             continue
         
         # Validate package structure
         structure_errors = validate_package_structure(package_name, package_data)
-        for error in structure_errors:
-            print(f"❌ {error}")
-            total_errors += 1
-        
-        if structure_errors:
-            print()
-            continue
-        
-        # Validate package versions
-        version_errors, version_warnings = validate_package_versions(package_name, package_data)
-        for error in version_errors:
-            print(f"❌ {error}")
-            total_errors += 1
-        for warning in version_warnings:
-            print(f"⚠️ {warning}")
-            total_warnings += 1
-        
-        if not structure_errors and not version_errors and not version_warnings:
-            print(f"✅ Package {package_name} is valid")
+        cached = file_hash in cache
+        packages.append((package_name, package_data, structure_errors, file_hash, cached))
+        if not structure_errors and not cached:
+            downloads.extend(collect_download_urls(package_name, package_data))
+    
+    # Check all download URLs concurrently
+    print(f"🌐 Checking {len(downloads)} download URLs...\n")
+    url_results = check_download_urls(downloads)
+    
+    # Report on each package, writing each package's block in one go
+    now = time.time()
+    for package_name, package_data, structure_errors, file_hash, cached in packages:
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            errors, warnings = report_package(package_name, package_data, structure_errors, url_results, cached)
+        sys.stdout.write(buffer.getvalue())
+        all_errors.extend(errors)
+        all_warnings.extend(warnings)
         
-        print()
+        # Remember package files whose download URLs all checked out
+        if file_hash and not errors and not cached:
+            cache[file_hash] = {"package": package_name, "timestamp": now}
+    
+    save_validation_cache(cache)
+    write_report(all_errors, all_warnings)
     
     # Summary
     print("=" * 50)
     print("VALIDATION SUMMARY")
     print("=" * 50)
-    print(f"Errors: {total_errors}")
-    print(f"Warnings: {total_warnings}")
+    print(f"Errors: {len(all_errors)}")
+    print(f"Warnings: {len(all_warnings)}")
     
-    if total_errors > 0:
+    if all_errors:
         print("\n❌ Validation failed!")
         return 1
     else: